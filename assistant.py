@@ -4,7 +4,11 @@ import ollama
 import sys
 import time
 import os
+import re
 import json
+import mmap
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -31,6 +35,12 @@ DEFAULT_CONFIG = {
     "top_p": 0.9,
     "num_ctx": 8192,
     "num_predict": 800,
+    "render_fps": 20,
+    "render_markdown": True,
+    "max_tool_rounds": 2,
+    "max_tool_calls": 4,
+    "analysis_workers": 4,
+    "cache_dir": str(Path.home() / ".ai_assistant" / "cache"),
     "first_run": True
 }
 
@@ -222,7 +232,7 @@ def extraer_contexto_conversacional(messages, num_intercambios=3):
     for msg in recent_msgs:
         if msg['role'] == 'user':
             content = msg['content']
-            if '=== WEB SEARCH DATA' in content or '=== SEARCH RESULTS' in content:
+            if '=== WEB SEARCH DATA' in content or '=== SEARCH RESULTS' in content or '=== AUTO-SEARCH DATA' in content:
                 lines = content.split('\n')
                 for line in lines:
                     if line.strip() and not line.startswith('===') and not line.startswith('IMPORTANT') and not line.startswith('CONTEXT'):
@@ -239,7 +249,7 @@ def extraer_contexto_conversacional(messages, num_intercambios=3):
         return "\n".join(context_parts)
     return ""
 
-def buscar_web(query, messages=None):
+def buscar_web(query, messages=None, mostrar_progreso=True):
     
     queries_vagas = ['improve it', 'how to do it', 'how effective', 'more information', 'explain it', 'give examples', 'how to do']
     query_original = query
@@ -265,14 +275,15 @@ def buscar_web(query, messages=None):
                         query_enriquecida = f"{keywords} {query}"
                     break
     
-    if query_enriquecida != query_original:
-        print(f"🌐 Searching: '{query_original}'...")
-        print(f"   Enhanced query: '{query_enriquecida}'")
-    else:
-        print(f"🌐 Searching: '{query_enriquecida}'...")
-    
-    if contexto:
-        print(f"   With conversational context")
+    if mostrar_progreso:
+        if query_enriquecida != query_original:
+            print(f"🌐 Searching: '{query_original}'...")
+            print(f"   Enhanced query: '{query_enriquecida}'")
+        else:
+            print(f"🌐 Searching: '{query_enriquecida}'...")
+        
+        if contexto:
+            print(f"   With conversational context")
     
     try:
         time.sleep(0.5)
@@ -288,10 +299,12 @@ def buscar_web(query, messages=None):
                 pass
             
             if not results:
-                print("   No results found")
+                if mostrar_progreso:
+                    print("   No results found")
                 return (None, None) if messages else None
             
-            print(f"   Found {len(results)} results")
+            if mostrar_progreso:
+                print(f"   Found {len(results)} results")
             
             formatted = []
             for i, r in enumerate(results[:5], 1):
@@ -309,9 +322,162 @@ def buscar_web(query, messages=None):
                 return (None, resultados)
     
     except Exception as e:
-        print(f"   Search error: {type(e).__name__}: {e}")
+        if mostrar_progreso:
+            print(f"   Search error: {type(e).__name__}: {e}")
         return (None, None) if messages else None
 
+HERRAMIENTAS = [
+    {
+        'type': 'function',
+        'function': {
+            'name': 'web_search',
+            'description': 'Search the web for recent events, updated data or anything outside your training data. '
+                           'For questions with several facets, call it several times in the same turn, one query per facet.',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'query': {'type': 'string', 'description': 'Specific, self-contained search query'},
+                },
+                'required': ['query'],
+            },
+        },
+    },
+]
+
+MODELOS_SIN_HERRAMIENTAS = set()
+MAX_WORKERS_HERRAMIENTAS = 3
+
+INSTRUCCION_HERRAMIENTAS = """
+HOW TO SEARCH:
+Call the web_search tool. For questions with several facets, request all the searches you need at once in the same turn.
+"""
+
+# Text protocol for models that do not support Ollama's tools API
+INSTRUCCION_SEARCH_TEXTO = """
+HOW TO SEARCH:
+To request search, respond ONLY:
+SEARCH: <your query>
+"""
+
+INSTRUCCION_SIN_BUSQUEDA = """
+Web search is no longer available for this answer: respond with the data you already have.
+"""
+
+def preparar_turno(messages, instruccion):
+    turno = list(messages)
+    turno[0] = {"role": "system", "content": messages[0]['content'] + instruccion}
+    return turno
+
+def herramienta_web_search(argumentos):
+    query = str(argumentos.get('query', '')).strip()
+    if not query:
+        raise ValueError("missing 'query' argument")
+    result = buscar_web(query, mostrar_progreso=False)
+    if result and result[1]:
+        return result[1]
+    return None
+
+EJECUTORES = {
+    'web_search': herramienta_web_search,
+}
+
+def ejecutar_herramientas(llamadas, config):
+    # Returns (nombre, argumentos, contenido, ok); placeholders for the model have ok=False
+    def ejecutar(llamada):
+        nombre = llamada['function']['name']
+        argumentos = llamada['function']['arguments'] or {}
+        try:
+            if isinstance(argumentos, str):
+                argumentos = json.loads(argumentos)
+            ejecutor = EJECUTORES.get(nombre)
+            if not ejecutor:
+                return nombre, argumentos, f"Unknown tool: {nombre}", False
+            contenido = ejecutor(argumentos)
+            if contenido is None:
+                return nombre, argumentos, "No results found", False
+            return nombre, argumentos, contenido, True
+        except Exception as e:
+            return nombre, argumentos, f"Tool error: {type(e).__name__}: {e}", False
+
+    # Extra calls are answered without running, so every call still gets its result
+    limite = max(1, config['max_tool_calls'])
+    omitidas = [(llamada['function']['name'], llamada['function']['arguments'] or {},
+                 f"Not executed: at most {limite} tool calls per round", False)
+                for llamada in llamadas[limite:]]
+    llamadas = llamadas[:limite]
+
+    for llamada in llamadas:
+        print(f"[Tools] {llamada['function']['name']}: {json.dumps(llamada['function']['arguments'], ensure_ascii=False)}")
+    if omitidas:
+        print(f"[Tools] {len(omitidas)} extra call(s) skipped (max_tool_calls = {limite})")
+
+    with ThreadPoolExecutor(max_workers=min(len(llamadas), MAX_WORKERS_HERRAMIENTAS)) as executor:
+        return list(executor.map(ejecutar, llamadas)) + omitidas
+
+def responder_con_herramientas(modelo, messages, config, encabezado):
+    # Works on a copy: only the final answer (and a digest of the tool data) is kept in history
+    usa_herramientas = modelo not in MODELOS_SIN_HERRAMIENTAS
+    turno = preparar_turno(messages, INSTRUCCION_HERRAMIENTAS if usa_herramientas else INSTRUCCION_SEARCH_TEXTO)
+    usadas = []
+    textos = []
+    mostrado = False
+    rondas = 0
+
+    while rondas < config['max_tool_rounds']:
+        # Once some text is on screen, later rounds continue it instead of repeating the header
+        encabezado_ronda = "" if mostrado else encabezado
+        llamadas = []
+        if usa_herramientas:
+            try:
+                texto = responder_stream(modelo, turno, config, encabezado_ronda, HERRAMIENTAS, llamadas)
+            except ollama.ResponseError as e:
+                if 'does not support tools' not in str(e):
+                    raise
+                print(f"[Tools] {modelo} does not support tool calling, using SEARCH: requests")
+                MODELOS_SIN_HERRAMIENTAS.add(modelo)
+                usa_herramientas = False
+                turno = preparar_turno(messages, INSTRUCCION_SEARCH_TEXTO)
+                continue
+        else:
+            texto = responder_stream(modelo, turno, config, encabezado_ronda, ocultar_prefijo="SEARCH:")
+            pedido = re.match(r'\s*SEARCH:[ \t]*(.+)', texto)
+            if pedido:
+                llamadas = [{'function': {'name': 'web_search', 'arguments': {'query': pedido.group(1).strip()}}}]
+
+        if not llamadas:
+            textos.append(texto)
+            return "\n\n".join(t for t in textos if t.strip()), usadas
+
+        rondas += 1
+        resultados = ejecutar_herramientas(llamadas, config)
+        # Placeholders (skipped calls, no results, errors) go to the model but not into history
+        usadas.extend((nombre, argumentos, contenido) for nombre, argumentos, contenido, ok in resultados if ok)
+
+        if usa_herramientas:
+            # A hidden SEARCH: reply shows nothing, so only tool rounds can have text on screen
+            mostrado = mostrado or bool(texto)
+            textos.append(texto)
+            turno.append({"role": "assistant", "content": texto, "tool_calls": llamadas})
+            for nombre, _, contenido, _ in resultados:
+                turno.append({"role": "tool", "content": contenido, "tool_name": nombre})
+        else:
+            _, argumentos, contenido, _ = resultados[0]
+            turno.append({"role": "assistant", "content": texto})
+            turno.append({"role": "user", "content": f"""=== AUTO-SEARCH DATA ===
+Search: {argumentos['query']}
+
+Results:
+{contenido}
+=== END ===
+
+NOW respond using this data.
+"""})
+
+    print("[Tools] Round limit reached, answering with the data collected")
+    turno[0] = {"role": "system", "content": messages[0]['content'] + INSTRUCCION_SIN_BUSQUEDA}
+    textos.append(responder_stream(modelo, turno, config, "" if mostrado else encabezado))
+    return "\n\n".join(t for t in textos if t.strip()), usadas
+
 def aplicar_sliding_window(messages, max_messages=20):
     if len(messages) <= max_messages + 1:
         return messages
@@ -323,6 +489,417 @@ def aplicar_sliding_window(messages, max_messages=20):
     
     return [system_msg] + recent_messages
 
+def opciones_modelo(config):
+    return {
+        'temperature': config['temperature'],
+        'top_p': config['top_p'],
+        'num_ctx': config['num_ctx'],
+        'num_predict': config['num_predict'],
+    }
+
+class StreamRenderer:
+
+    RESET = "\033[0m"
+    BOLD = "\033[1m"
+    DIM = "\033[2m"
+    CYAN = "\033[36m"
+
+    def __init__(self, config, ocultar_prefijo=None):
+        self.tty = sys.stdout.isatty()
+        # Replies starting with this prefix are returned but never shown (e.g. "SEARCH:" requests)
+        self.ocultar_prefijo = ocultar_prefijo
+        self.oculto = False
+        self.markdown = self.tty and config['render_markdown']
+        self.intervalo = 1.0 / max(1, config['render_fps'])
+        self.partes = []
+        self.pendiente = []
+        self.ultimo_volcado = 0.0
+        self.inicio_linea = ""
+        self.estilo = None
+        self.en_codigo = False
+
+    def start(self, encabezado):
+        # The header goes out with the first text, so tool-call-only rounds print nothing.
+        # Without a TTY nothing is repainted: header and answer are written once in finish()
+        self.pendiente.append(encabezado)
+
+    def write(self, texto):
+        if not texto:
+            return
+        self.partes.append(texto)
+        if self.ocultar_prefijo is not None:
+            inicio = "".join(self.partes).lstrip()
+            if len(inicio) < len(self.ocultar_prefijo) and self.ocultar_prefijo.startswith(inicio):
+                return
+            self.oculto = inicio.startswith(self.ocultar_prefijo)
+            self.ocultar_prefijo = None
+            texto = "".join(self.partes)
+        if self.oculto or not self.tty:
+            return
+        self.pendiente.append(self.formatear(texto) if self.markdown else texto)
+        ahora = time.monotonic()
+        if ahora - self.ultimo_volcado >= self.intervalo:
+            self.volcar()
+            self.ultimo_volcado = ahora
+
+    def formatear(self, texto):
+        # Styles whole lines: the style is picked once the start of the line is known
+        salida = []
+        for pieza in re.findall(r'[^\n]*\n|[^\n]+', texto):
+            if self.estilo is None:
+                self.inicio_linea += pieza
+                if not pieza.endswith('\n') and len(self.inicio_linea.lstrip()) < 3:
+                    continue
+                pieza, self.inicio_linea = self.inicio_linea, ""
+                self.estilo = self.estilo_linea(pieza)
+                salida.append(self.estilo)
+            salida.append(pieza)
+            if pieza.endswith('\n'):
+                if self.estilo:
+                    salida.append(self.RESET)
+                self.estilo = None
+        return "".join(salida)
+
+    def estilo_linea(self, linea):
+        contenido = linea.lstrip()
+        if contenido.startswith("```"):
+            self.en_codigo = not self.en_codigo
+            return self.DIM
+        if self.en_codigo:
+            return self.CYAN
+        if contenido.startswith("#"):
+            return self.BOLD
+        return ""
+
+    def volcar(self):
+        if self.pendiente:
+            sys.stdout.write("".join(self.pendiente))
+            sys.stdout.flush()
+            self.pendiente = []
+
+    def finish(self):
+        if self.oculto or not self.partes:
+            self.pendiente = []
+            return "".join(self.partes)
+        if self.ocultar_prefijo is not None and self.tty:
+            # Short reply that never reached the prefix length: show what was held back
+            texto = "".join(self.partes)
+            self.pendiente.append(self.formatear(texto) if self.markdown else texto)
+        if self.markdown and self.inicio_linea:
+            self.estilo = self.estilo_linea(self.inicio_linea)
+            self.pendiente.append(self.estilo + self.inicio_linea)
+        if self.markdown and self.estilo:
+            self.pendiente.append(self.RESET)
+        if not self.tty:
+            self.pendiente.extend(self.partes)
+        self.pendiente.append("\n\n")
+        self.volcar()
+        return "".join(self.partes)
+
+def responder_stream(modelo, messages, config, encabezado, herramientas=None, llamadas=None, ocultar_prefijo=None):
+    response = ollama.chat(
+        model=modelo,
+        messages=messages,
+        stream=True,
+        tools=herramientas,
+        options=opciones_modelo(config)
+    )
+
+    render = StreamRenderer(config, ocultar_prefijo)
+    render.start(encabezado)
+
+    try:
+        for chunk in response:
+            if 'message' in chunk and 'content' in chunk['message']:
+                render.write(chunk['message']['content'])
+            if llamadas is not None and 'message' in chunk and chunk['message'].get('tool_calls'):
+                llamadas.extend(chunk['message']['tool_calls'])
+    except BaseException:
+        # Show what already arrived, through the same path as a normal ending
+        render.finish()
+        raise
+
+    return render.finish()
+
+# Conservative: code and non-English text run close to 3 chars per token
+CHARS_POR_TOKEN = 3
+MARGEN_SEGURIDAD = 0.75
+MAX_CHUNKS_SIN_CONFIRMAR = 20
+DIRS_IGNORADOS = {'.git', '.hg', '.svn', '__pycache__', 'node_modules', '.venv', 'venv', '.mypy_cache', '.pytest_cache', '.tox', 'dist', 'build'}
+PATRON_LIMITE = re.compile(r'^(async def |def |class |function |func |fn |pub fn |impl |struct |#{1,6} )')
+PATRON_LINEAS = re.compile(r'\b([Ll]ines?)\s+(\d+)(?:(\s*[-–]\s*)(\d+))?')
+
+def estimar_tokens(texto):
+    return (len(texto) + CHARS_POR_TOKEN - 1) // CHARS_POR_TOKEN
+
+def presupuesto_chunk(config):
+    # Room left in the context window after the prompt template and the answer
+    return max(512, int((config['num_ctx'] - config['num_predict'] - 512) * MARGEN_SEGURIDAD))
+
+def contexto_disponible(messages, config):
+    # Room left for the final analysis once history, system prompt and answer are counted
+    usados = sum(estimar_tokens(m['content']) for m in messages)
+    return int((config['num_ctx'] - config['num_predict'] - usados) * MARGEN_SEGURIDAD) - 256
+
+def es_binario(ruta):
+    try:
+        with open(ruta, 'rb') as f:
+            return b'\0' in f.read(8192)
+    except OSError:
+        return True
+
+def recolectar_archivos(ruta):
+    if os.path.isfile(ruta):
+        if es_binario(ruta):
+            print(f"   Skipping binary file: {ruta}")
+            return []
+        return [ruta]
+
+    archivos = []
+    for raiz, dirs, nombres in os.walk(ruta):
+        dirs[:] = sorted(d for d in dirs if d not in DIRS_IGNORADOS and not d.startswith('.'))
+        for nombre in sorted(nombres):
+            if nombre.startswith('.'):
+                continue
+            completo = os.path.join(raiz, nombre)
+            if os.path.isfile(completo) and not es_binario(completo):
+                archivos.append(completo)
+    return archivos
+
+def leer_bloques(ruta):
+    # Streams the file through mmap, cutting at blank lines and top-level definitions
+    with open(ruta, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            bloque = []
+            for raw in iter(mm.readline, b''):
+                linea = raw.decode('utf-8', errors='replace')
+                if bloque and PATRON_LIMITE.match(linea):
+                    yield ''.join(bloque)
+                    bloque = []
+                bloque.append(linea)
+                if not linea.strip():
+                    yield ''.join(bloque)
+                    bloque = []
+            if bloque:
+                yield ''.join(bloque)
+
+def partir_bloque(bloque, max_chars):
+    actual = []
+    tamano = 0
+    for linea in bloque.splitlines(keepends=True):
+        while len(linea) > max_chars:
+            if actual:
+                yield ''.join(actual)
+                actual, tamano = [], 0
+            yield linea[:max_chars]
+            linea = linea[max_chars:]
+        if actual and tamano + len(linea) > max_chars:
+            yield ''.join(actual)
+            actual, tamano = [], 0
+        actual.append(linea)
+        tamano += len(linea)
+    if actual:
+        yield ''.join(actual)
+
+def dividir_en_chunks(bloques, max_tokens):
+    max_chars = max_tokens * CHARS_POR_TOKEN
+    actual = []
+    tamano = 0
+
+    for bloque in bloques:
+        if len(bloque) > max_chars:
+            if actual:
+                yield ''.join(actual)
+                actual, tamano = [], 0
+            yield from partir_bloque(bloque, max_chars)
+            continue
+
+        # Near the end of the budget, prefer to cut right before a new function/class/heading
+        corte_preferido = tamano >= max_chars * 0.85 and PATRON_LIMITE.match(bloque)
+        if actual and (tamano + len(bloque) > max_chars or corte_preferido):
+            yield ''.join(actual)
+            actual, tamano = [], 0
+
+        actual.append(bloque)
+        tamano += len(bloque)
+
+    if actual:
+        yield ''.join(actual)
+
+def clave_cache(*partes):
+    return hashlib.sha256('\0'.join(partes).encode('utf-8')).hexdigest()
+
+def leer_cache(config, clave):
+    ruta = Path(config['cache_dir']) / f"{clave}.json"
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f)['result']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def guardar_cache(config, clave, resultado):
+    try:
+        cache_dir = Path(config['cache_dir'])
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(cache_dir / f"{clave}.json", 'w', encoding='utf-8') as f:
+            json.dump({'result': resultado}, f, ensure_ascii=False)
+    except OSError:
+        pass
+
+def consultar_con_cache(modelo, config, prompt, partes_clave):
+    clave = clave_cache(modelo, json.dumps(opciones_modelo(config), sort_keys=True), *partes_clave)
+    resultado = leer_cache(config, clave)
+    if resultado is not None:
+        return resultado, True
+
+    response = ollama.chat(
+        model=modelo,
+        messages=[
+            {"role": "system", "content": "You are a precise code and document analyst. Answer only from the text you are given."},
+            {"role": "user", "content": prompt},
+        ],
+        options=opciones_modelo(config)
+    )
+    resultado = response['message']['content'].strip()
+    guardar_cache(config, clave, resultado)
+    return resultado, False
+
+def ejecutar_en_paralelo(tareas, modelo, config, etiqueta):
+    # tareas: (prompt, partes_clave) pairs; the cache key is built from partes_clave only
+    resultados = [None] * len(tareas)
+    hechos = cacheados = fallidos = 0
+
+    executor = ThreadPoolExecutor(max_workers=max(1, config['analysis_workers']))
+    futuros = {executor.submit(consultar_con_cache, modelo, config, p, c): i for i, (p, c) in enumerate(tareas)}
+    try:
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                resultados[i], desde_cache = futuro.result()
+                cacheados += desde_cache
+            except Exception as e:
+                resultados[i] = f"(analysis failed: {e})"
+                fallidos += 1
+            hechos += 1
+            print(f"\r[{etiqueta}] {hechos}/{len(tareas)} done, {cacheados} cached, {fallidos} failed", end="", flush=True)
+    except KeyboardInterrupt:
+        # Drop queued requests instead of letting shutdown(wait=True) run them all
+        for futuro in futuros:
+            futuro.cancel()
+        executor.shutdown(wait=False)
+        print(f"\n[{etiqueta}] Canceled, {len(tareas) - hechos} pending request(s) discarded")
+        raise
+
+    executor.shutdown()
+    print()
+    return resultados
+
+def ajustar_lineas(texto, desplazamiento):
+    # Chunk analyses cite lines relative to the fragment; shift them to file line numbers
+    def sumar(m):
+        fin = f"{m.group(3)}{int(m.group(4)) + desplazamiento}" if m.group(4) else ""
+        return f"{m.group(1)} {int(m.group(2)) + desplazamiento}{fin}"
+    return PATRON_LINEAS.sub(sumar, texto) if desplazamiento else texto
+
+def analizar_ruta(ruta, pregunta, modelo, config, messages):
+    limite_final = contexto_disponible(messages, config) - estimar_tokens(pregunta)
+    if limite_final < 512:
+        print("Conversation history leaves no room for the analysis. Use 'clear' and try again.")
+        return None
+
+    archivos = recolectar_archivos(ruta)
+    if not archivos:
+        print("No readable text files found")
+        return None
+
+    presupuesto = presupuesto_chunk(config)
+    etiquetas = []
+    desplazamientos = []
+    tareas = []
+
+    for archivo in archivos:
+        nombre = os.path.relpath(archivo, ruta) if os.path.isdir(ruta) else os.path.basename(archivo)
+        linea = 1
+        try:
+            for chunk in dividir_en_chunks(leer_bloques(archivo), presupuesto):
+                fin = linea + chunk.count('\n')
+                if chunk.strip():
+                    ultima = fin - 1 if chunk.endswith('\n') else fin
+                    etiquetas.append(f"{nombre} (lines {linea}-{ultima})")
+                    desplazamientos.append(linea - 1)
+                    # Name and position stay out of the prompt so the cache survives edits elsewhere and renames
+                    extension = os.path.splitext(archivo)[1] or "(none)"
+                    tareas.append((f"""=== FILE FRAGMENT (file type: {extension}) ===
+{chunk}
+=== END FRAGMENT ===
+
+Task: {pregunta}
+
+Analyze ONLY this fragment. List the relevant findings concisely, citing names and lines.
+Cite lines as "line N", counting from 1 at the first line of this fragment.
+If nothing in it is relevant to the task, answer: NOTHING RELEVANT.
+""", ("chunk", extension, pregunta, hashlib.sha256(chunk.encode('utf-8')).hexdigest())))
+                linea = fin
+        except (OSError, ValueError) as e:
+            print(f"   Skipping {nombre}: {e}")
+
+    if not tareas:
+        print("Nothing to analyze (empty files)")
+        return None
+
+    print(f"📄 {len(archivos)} file(s), {len(tareas)} chunk(s) of up to ~{presupuesto} tokens")
+    if len(tareas) > MAX_CHUNKS_SIN_CONFIRMAR:
+        confirmar = input(f"This sends up to {len(tareas)} requests to the model. Continue? (y/n): ").strip().lower()
+        if confirmar != 'y':
+            print("Analysis canceled")
+            return None
+
+    parciales = ejecutar_en_paralelo(tareas, modelo, config, "Analysis")
+    parciales = [f"[{e}]\n{ajustar_lineas(p, d)}" for e, d, p in zip(etiquetas, desplazamientos, parciales)
+                 if not p.strip().upper().startswith("NOTHING RELEVANT")]
+
+    # Merge partial analyses in batches until they fit in what the conversation leaves free
+    while len(parciales) > 1 and estimar_tokens("\n\n".join(parciales)) > limite_final:
+        grupos = []
+        for parcial in parciales:
+            if grupos and estimar_tokens("\n\n".join(grupos[-1] + [parcial])) <= presupuesto:
+                grupos[-1].append(parcial)
+            else:
+                grupos.append([parcial])
+        if len(grupos) == len(parciales):
+            break
+
+        prompts = ["\n\n".join(grupo) + f"""
+
+=== END PARTIAL ANALYSES ===
+
+Task: {pregunta}
+
+Merge these partial analyses into one concise analysis. Keep file names and line references.
+""" for grupo in grupos]
+        parciales = ejecutar_en_paralelo([(p, ("merge", p)) for p in prompts], modelo, config, "Merge")
+
+    if not parciales:
+        parciales = ["NOTHING RELEVANT found in any chunk."]
+
+    analisis = "\n\n".join(parciales)
+    if estimar_tokens(analisis) > limite_final:
+        analisis = analisis[:limite_final * CHARS_POR_TOKEN] + "\n(analysis truncated to fit the context window)"
+    return f"""=== FILE ANALYSIS DATA ===
+Source: {ruta}
+Files: {len(archivos)}
+
+Partial analyses:
+{analisis}
+=== END DATA ===
+
+IMPORTANT: These are analyses of the file contents, chunk by chunk. Combine them into a single complete answer.
+
+{pregunta}
+"""
+
 def guardar_sesion(messages, modelo, mensaje_count, cambios_modelo, config):
     try:
         log_dir = config['logs_dir']
@@ -382,6 +959,7 @@ def asistente(modelo, config):
     print("  - 'models': View available models")
     print("  - 'search <query>': Force manual web search")
     print("  - '```': Start multi-line mode (end with ```)")
+    print("  - 'file <path>' / 'dir <path>': Analyze large files or folders in chunks")
     print("  - 'config': Reconfigure assistant")
     print(f"{assistant_name} has contextual and intelligent web search\n")
     
@@ -423,9 +1001,6 @@ BEHAVIOR RULES:
 WEB SEARCH CAPABILITY:
 If you DON'T know specific information, new terms, updated data, recent events or anything outside your training data, you can request a web search.
 
-To request search, respond ONLY:
-SEARCH: <your query>
-
 WEB SEARCH RULES (v7.82 - DIRECT ACTION):
 1. If you receive WEB SEARCH DATA, use it as primary source
 2. When search data has code/examples, IMPLEMENT the solution directly
@@ -538,28 +1113,7 @@ IMPORTANT: Use context and data to respond.
                         print(f"[{assistant_name}] processing...")
                         
                         try:
-                            response = ollama.chat(
-                                model=modelo,
-                                messages=messages,
-                                stream=True,
-                                options={
-                                    'temperature': config['temperature'],
-                                    'top_p': config['top_p'],
-                                    'num_ctx': config['num_ctx'],
-                                    'num_predict': config['num_predict'],
-                                }
-                            )
-                            
-                            print(f"\n[{assistant_name}] (#{mensaje_count + 1}): ", end="", flush=True)
-                            assistant_message = ""
-                            
-                            for chunk in response:
-                                if 'message' in chunk and 'content' in chunk['message']:
-                                    content = chunk['message']['content']
-                                    print(content, end="", flush=True)
-                                    assistant_message += content
-                            
-                            print("\n")
+                            assistant_message = responder_stream(modelo, messages, config, f"\n[{assistant_name}] (#{mensaje_count + 1}): ")
                             messages.append({"role": "assistant", "content": assistant_message})
                             mensaje_count += 1
                         except Exception as e:
@@ -569,6 +1123,41 @@ IMPORTANT: Use context and data to respond.
                     else:
                         print("Could not perform search")
                 continue
+
+            # Only an existing path makes it a command: "file handling in python?" stays a chat message
+            comando, _, ruta = user_input.partition(" ")
+            comando = comando.lower()
+            ruta = os.path.expanduser(ruta.strip().strip('"\''))
+            if ruta and ((comando == "file" and os.path.isfile(ruta)) or (comando == "dir" and os.path.isdir(ruta))):
+                pregunta = input("What should I analyze? [Enter for general review]: ").strip()
+                if not pregunta:
+                    pregunta = "Summarize this content and point out bugs, risks and possible improvements."
+                
+                try:
+                    user_message = analizar_ruta(ruta, pregunta, modelo, config, messages)
+                except KeyboardInterrupt:
+                    print("Analysis canceled")
+                    continue
+                except Exception as e:
+                    print(f"\nAnalysis error: {e}")
+                    print("Is Ollama running? Check with: ollama list")
+                    continue
+                
+                if user_message:
+                    messages.append({"role": "user", "content": user_message})
+                    messages = aplicar_sliding_window(messages, max_messages)
+                    
+                    print(f"[{assistant_name}] processing...")
+                    
+                    try:
+                        assistant_message = responder_stream(modelo, messages, config, f"\n[{assistant_name}] (#{mensaje_count + 1}): ")
+                        messages.append({"role": "assistant", "content": assistant_message})
+                        mensaje_count += 1
+                    except Exception as e:
+                        print(f"\nError: {e}")
+                        if messages[-1]["role"] == "user":
+                            messages.pop()
+                continue
             
             search_keywords = ["search", "look up", "find", "explain what is", "tell me what is"]
             needs_search = any(kw in user_input.lower() for kw in search_keywords)
@@ -599,98 +1188,29 @@ IMPORTANT: Based on context and search, provide clear response.
             print(f"[{assistant_name}] processing...")
             
             try:
-                response = ollama.chat(
-                    model=modelo,
-                    messages=messages,
-                    stream=True,
-                    options={
-                        'temperature': config['temperature'],
-                        'top_p': config['top_p'],
-                        'num_ctx': config['num_ctx'],
-                        'num_predict': config['num_predict'],
-                    }
-                )
-                
-                print(f"\n[{assistant_name}] (#{mensaje_count + 1}): ", end="", flush=True)
-                assistant_message = ""
+                assistant_message, herramientas_usadas = responder_con_herramientas(modelo, messages, config, f"\n[{assistant_name}] (#{mensaje_count + 1}): ")
                 
-                for chunk in response:
-                    if 'message' in chunk and 'content' in chunk['message']:
-                        content = chunk['message']['content']
-                        print(content, end="", flush=True)
-                        assistant_message += content
-                
-                print("\n")
-                
-                if assistant_message.strip().startswith("SEARCH:"):
-                    search_query = assistant_message.replace("SEARCH:", "").strip()
-                    print(f"[Auto-Search] Requested: '{search_query}'")
-                    
-                    result = buscar_web(search_query, messages)
-                    
-                    if result and result[1]:
-                        contexto_prev, resultados = result
-                        messages.pop()
-                        
-                        search_context = f"""=== AUTO-SEARCH DATA ===
+                if herramientas_usadas:
+                    search_context = f"""=== AUTO-SEARCH DATA ===
 Original query: {user_input}
-Search: {search_query}
 """
-                        if contexto_prev:
-                            search_context += f"\nCONTEXT:\n{contexto_prev}\n"
-                        
+                    for nombre, argumentos, contenido in herramientas_usadas:
                         search_context += f"""
+{nombre}: {json.dumps(argumentos, ensure_ascii=False)}
 Results:
-{resultados}
-=== END ===
-
-NOW respond using this data.
+{contenido}
 """
-                        messages.append({"role": "user", "content": search_context})
-                        
-                        print(f"\n[Reprocessing with web data...]")
-                        print(f"[{assistant_name}] processing...")
-                        
-                        try:
-                            retry_response = ollama.chat(
-                                model=modelo,
-                                messages=messages,
-                                stream=True,
-                                options={
-                                    'temperature': config['temperature'],
-                                    'top_p': config['top_p'],
-                                    'num_ctx': config['num_ctx'],
-                                    'num_predict': config['num_predict'],
-                                }
-                            )
-                            
-                            print(f"\n[{assistant_name}] (#{mensaje_count + 1}): ", end="", flush=True)
-                            final_message = ""
-                            
-                            for chunk in retry_response:
-                                if 'message' in chunk and 'content' in chunk['message']:
-                                    content = chunk['message']['content']
-                                    print(content, end="", flush=True)
-                                    final_message += content
-                            
-                            print("\n")
-                            
-                            messages.pop()
-                            messages.append({"role": "assistant", "content": final_message})
-                            mensaje_count += 1
-                            
-                        except Exception as e:
-                            print(f"\nError reprocessing: {e}")
-                            messages.pop()
-                    else:
-                        mensaje_count += 1
-                else:
-                    messages.append({"role": "assistant", "content": assistant_message})
-                    mensaje_count += 1
-                    
-                    if mensaje_count % auto_save_interval == 0:
-                        print(f"\n[Auto-save] Saving session (message #{mensaje_count})...")
-                        guardar_sesion(messages, modelo, mensaje_count, cambios_modelo, config)
+                    search_context += f"""=== END ===
+
+{user_message}"""
+                    messages[-1] = {"role": "user", "content": search_context}
+                
+                messages.append({"role": "assistant", "content": assistant_message})
+                mensaje_count += 1
+                
+                if mensaje_count % auto_save_interval == 0:
+                    print(f"\n[Auto-save] Saving session (message #{mensaje_count})...")
+                    guardar_sesion(messages, modelo, mensaje_count, cambios_modelo, config)
                 
             except Exception as e:
                 print(f"\nModel error: {e}")